@@ -0,0 +1 @@
+"""The subcommands of the development tools CLI, one module per command so each is only imported when invoked"""
@@ -0,0 +1,82 @@
+"""This module contains the `add-users` command"""
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+
+import click
+
+from viktor_dev_tools.commands.options import option_source
+from viktor_dev_tools.commands.options import option_source_pwd
+from viktor_dev_tools.commands.options import option_username
+from viktor_dev_tools.commands.options import option_workers
+
+REQUIRED_COLUMNS = {"first_name", "last_name", "email"}
+
+
+@click.command()
+@option_username
+@option_source
+@option_source_pwd
+@click.option(
+    "--filepath",
+    "-f",
+    help="The file path of the csv with the list of users.\n"
+    "The csv file contain the following columns:\n"
+    "- first_name\n"
+    "- last_name\n"
+    "- email\n"
+    "- job_title (Optional)",
+    prompt="File path",
+)
+@option_workers
+def add_users(source: str, username: str, source_pwd: str, filepath: str, workers: int):
+    """Add users in bulk to the domain.
+
+    \b
+    As a default, prompts user to fill in a password for subdomain, unless token is provided.
+    If username is provided and source and destination are the same, password or token is re-used for destination.
+
+    Example usage:
+
+    $ add-users -u <username> -s <subdomain> -f <path/on/computer>
+
+    """
+    # pylint: disable=import-outside-toplevel
+    import requests
+
+    from viktor_dev_tools.tools.subdomain import ViktorUserDict
+    from viktor_dev_tools.tools.subdomain import get_domain
+
+    # utf-8-sig also strips the byte order mark that Excel writes at the start of a "CSV UTF-8" export
+    with open(filepath, newline="", encoding="utf-8-sig") as users_file:
+        reader = csv.DictReader(users_file)
+        missing_columns = REQUIRED_COLUMNS.difference(reader.fieldnames or [])
+        if missing_columns:
+            labels = ", ".join(f'"{column}"' for column in sorted(missing_columns))
+            raise click.BadParameter(f"CSV does not have a column with label {labels}", param_hint="--filepath")
+
+        users = [
+            ViktorUserDict(
+                first_name=user_dict["first_name"],
+                last_name=user_dict["last_name"],
+                name=f"{user_dict['first_name']} {user_dict['last_name']}",
+                email=user_dict["email"],
+                job_title=user_dict.get("job_title") or "",
+                is_dev=True,
+            )
+            for user_dict in reader
+        ]
+    if not users:
+        print(f"No users found in {filepath}")
+        return
+
+    source_domain = get_domain(source, username, source_pwd, workspace="1", token=None, max_workers=workers)
+    # Adding a user is a single independent request, so these are sent concurrently
+    with ThreadPoolExecutor(max_workers=min(workers, len(users))) as executor:
+        futures = {executor.submit(source_domain.add_user, user): user for user in users}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except requests.exceptions.HTTPError as e:
+                print(e)
+                print(f"Failed to add user: {futures[future]['name']}")
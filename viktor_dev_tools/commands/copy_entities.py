@@ -0,0 +1,72 @@
+"""This module contains the `copy-entities` command"""
+from typing import List
+
+import click
+
+from viktor_dev_tools.commands.options import destination_login_options
+from viktor_dev_tools.commands.options import option_destination_id
+from viktor_dev_tools.commands.options import option_source_id
+from viktor_dev_tools.commands.options import option_workers
+from viktor_dev_tools.commands.options import source_login_options
+
+
+@click.command()
+@source_login_options
+@destination_login_options
+@option_source_id
+@option_destination_id
+@click.option("--exclude-children", "-ec", is_flag=True, help="Exclude all children of source entity")
+@option_workers
+def copy_entities(
+    username: str,
+    source: str,
+    source_pwd: str,  # (default) will prompt for password unless `source_token` is supplied
+    destination_pwd: str,  # (default) will prompt for password unless `destination_token` is supplied
+    source_ws: str,
+    destination_ws: str,
+    destination: str,
+    source_token: str,  # (Optional) if not set, will ask for pwd instead
+    destination_token: str,  # (Optional) if not set, will ask for pwd instead
+    source_ids: List[int],
+    destination_id: int,
+    exclude_children: bool,
+    workers: int,
+) -> None:
+    """Copy entities between domains.
+
+    \b
+    As a default, prompts user to fill in a password for subdomain, unless token is provided.
+    If username is provided and source and destination are the same, password or token is re-used for destination.
+
+    Example usage:
+
+    $ copy-entities -s viktor  (prompts for password)
+
+    $ copy-entities -s viktor -st Afj..sf  (uses bearer token)
+
+
+    Allows copying multiple entity trees from the source, by specifying multiple source-ids. e.g. :
+
+    $ copy-entities <other options> -si 922 -si 1032 -si 124
+
+    """
+    # pylint: disable=import-outside-toplevel
+    from viktor_dev_tools.tools.subdomain import get_consolidated_login_details
+    from viktor_dev_tools.tools.subdomain import get_domain
+
+    if not destination:
+        destination = source
+
+    source_pwd, source_token, destination_pwd, destination_token = get_consolidated_login_details(
+        username, source, source_pwd, source_token, destination, destination_pwd, destination_token
+    )
+    source_domain = get_domain(source, username, source_pwd, source_token, source_ws, max_workers=workers)
+    destination_domain = get_domain(
+        destination, username, destination_pwd, destination_token, destination_ws, max_workers=workers
+    )
+
+    entity_type_mapping = source_domain.get_entity_type_mapping(destination_domain)
+
+    # The next entity trees are downloaded concurrently from the source while the current one is posted
+    for entity_tree in source_domain.iter_entity_trees(source_ids, exclude_children=exclude_children):
+        destination_domain.post_entity_tree(entity_tree, entity_type_mapping, parent_id=destination_id)
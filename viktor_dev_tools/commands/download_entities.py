@@ -0,0 +1,47 @@
+"""This module contains the `download-entities` command"""
+from typing import List
+
+import click
+
+from viktor_dev_tools.commands.options import option_workers
+from viktor_dev_tools.commands.options import source_login_options
+
+
+@click.command()
+@source_login_options
+@click.option("--destination", "-d", help="Destination path", prompt="Destination path")
+@click.option(
+    "--entity-type-names", "-etn", help="Entity type name (allows multiple)", prompt="Entity type name", multiple=True
+)
+@click.option("--include-revisions", "-rev", is_flag=True, help="Include all revisions of all entities Default: True")
+@option_workers
+def download_entities(
+    username: str,
+    source: str,
+    source_pwd: str,
+    source_token: str,
+    destination: str,
+    source_ws: str,
+    entity_type_names: List[str],
+    include_revisions: bool,
+    workers: int,
+) -> None:
+    """Download entities from domains.
+
+    Download entities from source to destination on local filesystem, by entity_type.
+
+    Example usage:
+
+    $ download-entities -s geo-tools -d <path/on/computer> -u <username> -etn 'CPT File' -rev
+
+    Allows copying multiple entities of multiple types from the source, by specifying multiple source-ids. e.g. :
+
+    $ copy-entities <other options> -etn Section -etn Project -etn 'CPT File'
+
+    """
+    from viktor_dev_tools.tools.subdomain import get_domain  # pylint: disable=import-outside-toplevel
+
+    source_domain = get_domain(source, username, source_pwd, source_token, source_ws, max_workers=workers)
+    source_domain.download_entities_of_type_to_local_folder(
+        destination, entity_type_names=entity_type_names, include_revisions=include_revisions
+    )
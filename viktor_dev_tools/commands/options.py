@@ -0,0 +1,59 @@
+"""This module contains the click options that are shared between the subcommands"""
+from typing import Callable
+
+import click
+
+option_username = click.option(
+    "--username",
+    "-u",
+    help="Username for both subdomains, "
+    "use this option when you want to reuse the credentials "
+    "for both source an destination on the same domain",
+)
+option_source = click.option("--source", "-s", help="Source subdomain", prompt="Source VIKTOR sub-domain")
+option_source_pwd = click.option("--source-pwd", "-sp", help="Source domain password")
+option_source_token = click.option("--source-token", "-st", help="Source domain token ")
+option_source_workspace = click.option(
+    "--source-ws", "-sw", help="Source workspace id or name", prompt="Source workspace ID"
+)
+option_destination = click.option(
+    "--destination",
+    "-d",
+    help="Destination subdomain",
+)
+option_destination_pwd = click.option("--destination-pwd", "-dp", help="Destination domain password")
+option_destination_token = click.option("--destination-token", "-dt", help="Destination domain token ")
+option_destination_workspace = click.option(
+    "--destination-ws", "-dw", help="Destination workspace ID", prompt="Destination workspace ID"
+)
+option_destination_id = click.option("--destination-id", "-di", help="Destination parent entity id ")
+option_source_id = click.option(
+    "--source-ids", "-si", help="Source entity id (allows multiple)", prompt="Source entity ID", multiple=True
+)
+option_workers = click.option(
+    "--workers",
+    "-w",
+    help="Maximum number of concurrent requests per subdomain",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+)
+
+
+def combine_options(*options: Callable) -> Callable:
+    """Combines click options into a single decorator, the options are listed in the help in the order as given"""
+
+    def decorator(function: Callable) -> Callable:
+        for option in reversed(options):
+            function = option(function)
+        return function
+
+    return decorator
+
+
+source_login_options = combine_options(
+    option_username, option_source, option_source_pwd, option_source_token, option_source_workspace
+)
+destination_login_options = combine_options(
+    option_destination, option_destination_pwd, option_destination_token, option_destination_workspace
+)
@@ -0,0 +1,53 @@
+"""This module contains the `stash-database` command"""
+import click
+
+from viktor_dev_tools.commands.options import option_workers
+from viktor_dev_tools.commands.options import source_login_options
+
+
+@click.command()
+@source_login_options
+@click.option("--destination", "-d", help="Destination path", prompt="Destination path")
+@click.option("--filename", "-f", help="Database filename (stored as json type)", prompt="Database filename")
+@click.option("--apply", "-a", help="Apply a stashed database", is_flag=True)
+@option_workers
+def stash_database(
+    username: str,
+    source: str,
+    source_pwd: str,
+    source_ws: str,
+    source_token: str,
+    destination: str,
+    filename: str,
+    apply: bool,
+    workers: int,
+) -> None:
+    """Stashes the database from some domain, and applies it to some domain.
+
+    You can only stash the database and apply the database if the amount of root entities in the manifest is still the
+    same.
+
+    By running this function without --apply, your database will be downloaded to some path specified by --destination
+    and --filename.
+
+    \b
+    By running this function with --apply, the following will happen to your database:
+        - Root entities will be replaced with their counterparts from the stashed database
+        - All children from any root entity will be deleted
+        - All children from the stashed database will be uploaded
+    The database used for uploading comes from a path specified by --destination and --filename.
+
+    Example usage:
+
+    \b
+    $ stash-database -u <username> -s <subdomain> -d <path/on/computer> -f dev-environment.json -sw 1
+    $ stash-database -u <username> -s <subdomain> -d <path/on/computer> -f dev-environment.json -sw 1 --apply
+    """
+    from viktor_dev_tools.tools.subdomain import get_domain  # pylint: disable=import-outside-toplevel
+
+    # source domain when stashing, destination domain when applying
+    domain = get_domain(source, username, source_pwd, source_token, source_ws, max_workers=workers)
+    if apply:
+        domain.upload_database_from_local_folder(source_folder=destination, filename=filename)
+    else:
+        domain.download_database_to_local_folder(destination, filename)
@@ -0,0 +1,21 @@
+"""This module contains the `upgrade` command"""
+import click
+
+
+@click.command()
+@click.option("--editable", "-e", is_flag=True, help="Install in editable mode, for development on the tools itself")
+def upgrade(editable: bool) -> None:
+    """Upgrade the cli dependencies.
+
+    By default the package is (re)installed from a built wheel, so the `dev-cli` script imports the cli directly.
+    """
+    # pylint: disable=import-outside-toplevel
+    import subprocess
+    import sys
+
+    # Run pip with the interpreter of the cli, a `pip` on the PATH may belong to another environment
+    pip_install_command = [sys.executable, "-m", "pip", "install", "--upgrade", "--use-pep517"]
+    if editable:
+        pip_install_command.append("-e")
+    pip_install_command.append(".")
+    subprocess.run(pip_install_command, check=True)
@@ -1,72 +1,154 @@
 """This module contains some related functions for a Viktor Sub-domain"""
-import copy
+import sys
+from collections import defaultdict
+from collections import deque
+from typing import Callable
+from typing import Deque
 from typing import Dict
+from typing import Iterable
 from typing import List
+from typing import Sequence
+from typing import Tuple
 from typing import Union
 
+# Updates the entity IDs in the given properties with the given old -> new mapping, returns whether anything changed
+EntityIdUpdater = Callable[[Union[Dict, List], Dict[int, int]], bool]
 
-def validate_root_entities_compatibility(source_root_entities, destination_root_entities):
-    """Validate that the manifest file still generated the same root entities"""
+
+def match_root_entities(
+    source_root_entities: Iterable[Dict], destination_root_entities: Iterable[Dict]
+) -> List[Tuple[Dict, Dict]]:
+    """Pairs each stashed root entity with the destination root entity of the same entity type
+
+    Root entities of the same type are paired in the order they are given. Raises a ValueError if the manifest no longer
+    generates the same root entities, i.e. if a root entity on either side has no counterpart.
+    """
     error_message = (
         "It appears the manifest has changed since your last stash. Please restore the root entities in "
         "the manifest file as they were stashed with."
     )
-    assert len(destination_root_entities) == len(source_root_entities), error_message
-    for source_root_entity, destination_root_entity in zip(source_root_entities, destination_root_entities):
-        assert source_root_entity["entity_type_name"] == destination_root_entity["entity_type_name"], error_message
+    destination_root_entities_per_type: Dict[str, Deque[Dict]] = defaultdict(deque)
+    for destination_root_entity in destination_root_entities:
+        destination_root_entities_per_type[destination_root_entity["entity_type_name"]].append(destination_root_entity)
+
+    matched_root_entities = []
+    for source_root_entity in source_root_entities:
+        destination_queue = destination_root_entities_per_type.get(source_root_entity["entity_type_name"])
+        if not destination_queue:
+            raise ValueError(f"{error_message} Missing root entity: {source_root_entity['entity_type_name']}")
+        matched_root_entities.append((source_root_entity, destination_queue.popleft()))
+    if any(destination_root_entities_per_type.values()):
+        raise ValueError(error_message)
+    return matched_root_entities
 
 
 def add_field_names_referring_to_entities_to_container(
-    parametrization_fields_list: List, field_names_list_container: List[List]
+    parametrization_fields_list: List, field_names_list_container: List[Union[str, Tuple]]
 ):
     """Get all the field names that refer to some entity.
 
     :param parametrization_fields_list: Use ViktorSubDomain().get_parametrization(entity_id)["parametrization"] as input
-    :param field_names_list_container: The result is added to the field_names_list_container. Looks like:
-        [['page_name', 'tab_name', 'field_name'], ['page_name', 'tab_name', 'array_name', ['field_name']]]
+    :param field_names_list_container: The result is added to the field_names_list_container. The path of an array is
+        tokenized once here, so it is not split again for every entity. Looks like:
+        [['page_name', 'tab_name', 'field_name'], ('page_name', 'tab_name', 'array_name', ['field_name'])]
     """
-    for field_dict in parametrization_fields_list:
+    # Iterative depth-first walk, each stack item holds the fields still to visit, the container their field names are
+    # added to and, for the items of an array, the array name and the container of the array itself (otherwise None)
+    stack = [(iter(parametrization_fields_list), field_names_list_container, None, None)]
+    while stack:
+        fields, container, array_name, array_container = stack[-1]
+        field_dict = next(fields, None)
+        if field_dict is None:  # All fields on this level are visited
+            stack.pop()
+            if array_name is not None and container:
+                # Interned, since many paths share the same page and tab names
+                array_container.append((*map(sys.intern, array_name.split(".")), *container))
+            continue
+        get = field_dict.get
         if "entity" in field_dict["type"]:
-            if field_dict.get("entity_type_name"):
-                field_names_list_container.append(field_dict["entity_type_name"])
-            if field_dict.get("name"):
-                field_names_list_container.append(field_dict["name"])
-        if "content" in field_dict.keys():
-            add_field_names_referring_to_entities_to_container(field_dict["content"], field_names_list_container)
-        if "arrayItems" in field_dict.keys():
-            new_container = []
-            add_field_names_referring_to_entities_to_container(field_dict["arrayItems"], new_container)
-            if new_container:
-                field_names_list_container.append(field_dict["name"].split(".") + new_container)
-
-
-def update_id_on_entity_fields(
-    field_names_list: List[Union[str, List]], properties: Union[Dict, List], old_to_new_ids_mapping: Dict[int, int]
-):
-    """Update the ID on entity ID related fields
+            if entity_type_name := get("entity_type_name"):
+                container.append(entity_type_name)
+            if name := get("name"):
+                container.append(name)
+        # Pushed in reverse, so the content is visited before the array items, and both before the next field
+        if "arrayItems" in field_dict:
+            stack.append((iter(field_dict["arrayItems"]), [], field_dict["name"], container))
+        if "content" in field_dict:
+            stack.append((iter(field_dict["content"]), container, None, None))
+
+
+def get_field_names_referring_to_entities(parametrization_fields_list: List) -> Tuple[Union[str, Tuple], ...]:
+    """Returns all the field names that refer to some entity, see add_field_names_referring_to_entities_to_container
+
+    The result is an immutable (hashable) tuple, so it can be cached and safely shared between entities.
+    """
+    field_names_list_container: List[Union[str, Tuple]] = []
+    add_field_names_referring_to_entities_to_container(parametrization_fields_list, field_names_list_container)
+    return tuple(field_names_list_container)
+
+
+def compile_entity_id_updater(field_names_list: Sequence[Union[str, Sequence]]) -> EntityIdUpdater:
+    """Compiles a list of field names into a function that updates the ID on the entity ID related field it refers to
+
+    The field names are analysed once here, so the path is not interpreted again for every entity the returned function
+    is called with, as `updater(properties, old_to_new_ids_mapping) -> changed`:
 
     Parameters
     ----------
-    field_names_list : List of field names where a field resides that refers to some entity.
-        Generated by get_field_names_referring_to_entities
-    properties : Properties dictionary or list of properties of an entity. Does not have to be top level necessarily
-    old_to_new_ids_mapping : Mapping dictionary of old_entity_id -> new_entity_id
+    field_names_list : List or tuple of field names where a field resides that refers to some entity.
+        Generated by get_field_names_referring_to_entities. It is not edited, so it may be reused for other entities
+    properties : Properties dictionary or list of properties of an entity, which is updated in place
+    old_to_new_ids_mapping : Mapping dictionary of old_entity_id -> new_entity_id. IDs that are not in the mapping, e.g.
+        referring to an entity that was not stashed, are kept as they are
+    changed : True if any ID in the properties was replaced, so the entity has to be updated
     """
-    field_names_list = copy.deepcopy(field_names_list)  # Copy to not edit anything in-place, list may be reused
-    if isinstance(field_names_list, list):
-        key_or_list = field_names_list.pop(0)
+    keys: List[str] = []
+    rows_updater = None
+    for key_or_list in field_names_list:
         if isinstance(key_or_list, str):
-            key = key_or_list
-            if len(field_names_list) == 0:  # If last item, set the new values
-                if isinstance(properties, dict):
-                    if isinstance(properties[key], int):
-                        properties[key] = old_to_new_ids_mapping[properties[key]]
-                    elif isinstance(properties[key], list):  # Might be a multiple select field
-                        for index, value in enumerate(properties[key]):
-                            properties[key][index] = old_to_new_ids_mapping[value]
-            else:  # Not the last item, go deeper
-                if isinstance(properties, dict):
-                    update_id_on_entity_fields(field_names_list, properties[key], old_to_new_ids_mapping)
-        elif isinstance(key_or_list, list):  # Nested structure! Let's go deeper for each of those
+            keys.append(key_or_list)
+        elif isinstance(key_or_list, (list, tuple)):  # Nested structure, the rest of the path is applied to each row
+            rows_updater = compile_entity_id_updater(key_or_list)
+            break
+        else:  # The path can never be followed, nothing is updated
+            return lambda properties, old_to_new_ids_mapping: False
+    path = tuple(keys) if rows_updater else tuple(keys[:-1])
+    last_key = None if rows_updater else keys[-1]
+
+    def update_ids(properties: Union[Dict, List], old_to_new_ids_mapping: Dict[int, int]) -> bool:
+        for key in path:
+            if not isinstance(properties, dict):
+                return False
+            properties = properties[key]
+        if rows_updater is not None:
+            changed = False
             for row in properties:
-                update_id_on_entity_fields(key_or_list, row, old_to_new_ids_mapping)
+                changed |= rows_updater(row, old_to_new_ids_mapping)
+            return changed
+        if not isinstance(properties, dict):
+            return False
+        new_id = old_to_new_ids_mapping.get
+        value = properties[last_key]
+        if isinstance(value, int):
+            properties[last_key] = new_id(value, value)
+            return properties[last_key] != value
+        if isinstance(value, list):  # Might be a multiple select field
+            properties[last_key] = [new_id(old_id, old_id) for old_id in value]
+            return properties[last_key] != value
+        return False
+
+    return update_ids
+
+
+def compile_entity_id_updaters(
+    field_names_list_container: Iterable[Union[str, Sequence]]
+) -> Tuple[EntityIdUpdater, ...]:
+    """Compiles the result of get_field_names_referring_to_entities, see compile_entity_id_updater
+
+    Plain field names in the container are skipped, since they do not describe a path to a field in the properties.
+    """
+    return tuple(
+        compile_entity_id_updater(field_names_list)
+        for field_names_list in field_names_list_container
+        if isinstance(field_names_list, (list, tuple)) and field_names_list
+    )
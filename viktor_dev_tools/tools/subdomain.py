@@ -1,8 +1,17 @@
 """This module contains a class representation and all related functions for a Viktor Sub-domain"""
+import functools
 import json
 import sys
+import threading
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
 from pathlib import Path
+from typing import Deque
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
 from typing import Tuple
@@ -11,16 +20,39 @@ from typing import Union
 
 import click
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 from viktor_dev_tools.tools.config import CLIENT_ID
 from viktor_dev_tools.tools.config import CLIENT_ID_SSO
-from viktor_dev_tools.tools.helper_functions import add_field_names_referring_to_entities_to_container
-from viktor_dev_tools.tools.helper_functions import update_id_on_entity_fields
-from viktor_dev_tools.tools.helper_functions import validate_root_entities_compatibility
+from viktor_dev_tools.tools.helper_functions import EntityIdUpdater
+from viktor_dev_tools.tools.helper_functions import compile_entity_id_updaters
+from viktor_dev_tools.tools.helper_functions import get_field_names_referring_to_entities
+from viktor_dev_tools.tools.helper_functions import match_root_entities
 
 # ============================== Authentication related classes and constants ============================== #
 
-_STANDARD_HEADERS = {"Content-Type": "application/json"}
+_MAX_WORKERS = 8  # Default maximum number of concurrent requests to a sub-domain
+_MAX_PREFETCHED_TREES = 4  # Maximum number of entity trees that copy-entities retrieves ahead of the one being posted
+
+
+@functools.lru_cache(maxsize=None)
+def _get_session(max_workers: int) -> requests.Session:
+    """Returns the session that is shared by all sub-domains during a CLI call.
+
+    The session keeps connections alive, so the TLS handshake is paid once per host instead of for every request, also
+    when a source and destination are on the same host. Failed idempotent requests are retried on rate limiting and
+    gateway errors. POST requests are never retried, as that could create an entity or user twice.
+    """
+    session = requests.Session()
+    # Authentication is done with the bearer token of each sub-domain, cookies should not be shared between them
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    retries = Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504], raise_on_status=False)
+    # Each sub-domain sends at most `max_workers` concurrent requests, and copying entities within one sub-domain uses
+    # two of them on the same host (the source and the destination)
+    pool_maxsize = 2 * max_workers
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retries))
+    return session
 
 
 # ============================== Entity dictionary related functions and classes ============================== #
@@ -63,18 +95,32 @@ def _repr_entities(entities: List[EntityDict]) -> str:
 
 
 def _get_element_count_of_tree(children: List[dict], size: int = 1) -> int:
-    """Recursively count all children in the tree"""
-    for child in children:
-        size += _get_element_count_of_tree(child["children"])
+    """Count all children in the tree, iteratively so deep trees do not hit the recursion limit"""
+    stack = list(children)
+    while stack:
+        child = stack.pop()
+        size += 1
+        stack.extend(child["children"])
     return size
 
 
+def _to_tree_node(entity: EntityDict) -> EntityDict:
+    """Returns the parts of an entity that are stored in an entity tree, without its children"""
+    return {
+        "id": entity["id"],
+        "entity_type": entity["entity_type"],
+        "name": entity["name"],
+        "properties": entity["properties"],
+        "children": [],
+    }
+
+
 # ============================== S3 related functions ============================== #
-def get_file_content_from_s3(entity: EntityDict) -> Optional[bytes]:
-    """If entity has a filename property, download the file_content from the temporary download url"""
+def get_file_content_from_s3(entity: EntityDict, session: requests.Session) -> Optional[bytes]:
+    """If entity has a filename property, download the file_content from the temporary download url with the session"""
     temp_download_url = entity["properties"].get("filename", None)
     if temp_download_url:
-        file_download = requests.get(temp_download_url, timeout=60)
+        file_download = session.get(temp_download_url, timeout=60)
         return file_download.content
     return None
 
@@ -102,15 +148,21 @@ def get_consolidated_login_details(
     return source_pwd, source_token, destination_pwd, destination_token
 
 
-def get_domain(subdomain, username, pwd, token, workspace: str, refresh_token=None):
+def get_domain(subdomain, username, pwd, token, workspace: str, refresh_token=None, max_workers: int = _MAX_WORKERS):
     """Create a subdomain either from SSO or username and password"""
     if token:
         return ViktorSubDomain.from_token(
-            sub_domain=subdomain, access_token=token, refresh_token=refresh_token, workspace=workspace
+            sub_domain=subdomain,
+            access_token=token,
+            refresh_token=refresh_token,
+            workspace=workspace,
+            max_workers=max_workers,
         )
     username = username or click.prompt(f"Username for {subdomain}")
     password = pwd or click.prompt(f"Password for {subdomain}", hide_input=True)
-    return ViktorSubDomain.from_login(sub_domain=subdomain, username=username, password=password, workspace=workspace)
+    return ViktorSubDomain.from_login(
+        sub_domain=subdomain, username=username, password=password, workspace=workspace, max_workers=max_workers
+    )
 
 
 def get_entity_type_mapping_from_entity_types(
@@ -119,12 +171,31 @@ def get_entity_type_mapping_from_entity_types(
     """Maps the id's of the entity types from source to destination, based on entity type name.
 
     The format used as input for this method is the output from ViktorSubDomain().get_entity_types()"""
-    mapping_dict: Dict[int, int] = {}
-    for destination_entity_type in destination_entity_types:
-        for source_entity_type in source_entity_types:
-            if source_entity_type["class_name"] == destination_entity_type["class_name"]:
-                mapping_dict.update({source_entity_type["id"]: destination_entity_type["id"]})
-    return mapping_dict
+    destination_ids_by_name = {entity_type["class_name"]: entity_type["id"] for entity_type in destination_entity_types}
+    return {
+        entity_type["id"]: destination_ids_by_name[entity_type["class_name"]]
+        for entity_type in source_entity_types
+        if entity_type["class_name"] in destination_ids_by_name
+    }
+
+
+class EntityIdChoice(click.ParamType):
+    """Click parameter type that only accepts one of the given entity ids"""
+
+    name = "entity_id"
+
+    def __init__(self, entity_ids: Iterable[int]):
+        self.entity_ids = set(entity_ids)
+
+    def convert(self, value, param, ctx) -> int:
+        """Converts the given value to an entity id, failing if it is not a number or not one of the entity ids"""
+        try:
+            entity_id = int(value)
+        except (TypeError, ValueError):
+            self.fail(f"{value!r} is not a valid entity id", param, ctx)
+        if entity_id not in self.entity_ids:
+            self.fail("Entity id not possible, please try again", param, ctx)
+        return entity_id
 
 
 class ViktorSubDomain:
@@ -133,6 +204,9 @@ class ViktorSubDomain:
     """
 
     _logged_in = False
+    # Workspace name to ID mappings per host and user, shared between instances (e.g. a source and destination on one
+    # sub-domain), since the workspaces visible to a user depend on who is logged in
+    _workspaces_mappings: Dict[Tuple[str, str], Dict[str, int]] = {}
 
     # ============================== All authentication related requests ============================== #
     def __init__(
@@ -143,16 +217,23 @@ class ViktorSubDomain:
         workspace: str,
         access_token: str = None,
         refresh_token: str = None,
+        max_workers: int = _MAX_WORKERS,
     ):
         print(f"Logging in to {sub_domain}")
         self.name = sub_domain
         self.host = f"https://{sub_domain}.viktor.ai/api"
         self.client_id = client_id
+        # The user is only known for a login with username and password, otherwise the token identifies the login
+        self.username: Optional[str] = auth_details.get("username")
+        self.max_workers = max_workers
+        self._session = _get_session(max_workers)
+        # Limits the concurrent requests to the sub-domain, which are sent from several thread pools (e.g. trees that are
+        # prefetched while another tree is posted, each retrieving its children concurrently)
+        self._requests_semaphore = threading.BoundedSemaphore(max_workers)
+        self._refresh_lock = threading.Lock()
         if not access_token:
             # Perform post request to '/o/token/' end-point to login
-            response = requests.post(
-                f"{self.host}/o/token/", data=json.dumps(auth_details), headers=_STANDARD_HEADERS, timeout=10
-            )
+            response = self._session.post(f"{self.host}/o/token/", json=auth_details, timeout=10)
             if not 200 <= response.status_code < 300:
                 print(f"Provided credentials are not valid.\n{response.text}")
                 sys.exit(1)
@@ -167,6 +248,10 @@ class ViktorSubDomain:
         print(f"Selecting workspace {self.workspace_id}")
         # Set empty parameters in init
         self._progressbar = None
+        self._entity_id_updaters: Dict[int, Tuple[EntityIdUpdater, ...]] = {}
+        self._entity_id_updaters_lock = threading.Lock()
+        self._entity_types: Optional[List[dict]] = None
+        self._entities_of_type: Dict[int, List[EntityDict]] = {}
         self._logged_in = True
 
     @property
@@ -174,7 +259,6 @@ class ViktorSubDomain:
         """Retrieves headers based on current access token"""
         return {
             "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json",
             "Cache-Control": "no-cache",
         }
 
@@ -187,7 +271,7 @@ class ViktorSubDomain:
         except ValueError as exc:
             workspace_id_or_name = workspace_id_or_name.lower()
             workspaces_mapping = self.get_workspaces_mapping()
-            if workspace_id_or_name.lower() not in workspaces_mapping.keys():
+            if workspace_id_or_name not in workspaces_mapping:
                 available_workspaces = "\n - ".join(workspaces_mapping.keys())
                 message = (
                     f"Requested workspace {workspace_id_or_name} was not found on subdomain. "
@@ -200,9 +284,7 @@ class ViktorSubDomain:
         """Log out of the subdomain by revoking the access access_token"""
         if self._logged_in and self.client_id == CLIENT_ID:  # Do not logout SSO, since token already expires in 15 min.
             payload = {"client_id": self.client_id, "token": self.access_token}
-            response = requests.post(
-                f"{self.host}/o/revoke_token/", data=json.dumps(payload), headers=_STANDARD_HEADERS, timeout=10
-            )
+            response = self._session.post(f"{self.host}/o/revoke_token/", json=payload, timeout=10)
             if 200 <= response.status_code < 300:
                 print(f"Successfully logged out ({self.name}) ")
             else:
@@ -212,15 +294,20 @@ class ViktorSubDomain:
     def refresh_tokens(self) -> None:
         """Tokens for SSO expire within 900 seconds, so this function refreshes the tokens when it is expired"""
         payload = {"refresh_token": self.refresh_token, "client_id": self.client_id, "grant_type": "refresh_token"}
-        response = requests.post(
-            f"{self.host}/o/token/", data=json.dumps(payload), headers=_STANDARD_HEADERS, timeout=10
-        )
+        response = self._session.post(f"{self.host}/o/token/", json=payload, timeout=10)
         response_json = response.json()
         self.access_token = response_json["access_token"]
         self.refresh_token = response_json["refresh_token"]
 
     @classmethod
-    def from_token(cls, sub_domain: str, access_token: str, refresh_token: str = None, workspace: str = "1"):
+    def from_token(
+        cls,
+        sub_domain: str,
+        access_token: str,
+        refresh_token: str = None,
+        workspace: str = "1",
+        max_workers: int = _MAX_WORKERS,
+    ):
         """Class method to login with Bearer Token, useful for SSO environments"""
         return cls(
             sub_domain=sub_domain,
@@ -229,86 +316,80 @@ class ViktorSubDomain:
             access_token=access_token,
             refresh_token=refresh_token,
             workspace=workspace,
+            max_workers=max_workers,
         )
 
     @classmethod
-    def from_login(cls, sub_domain: str, username: str, password: str, workspace: str) -> "ViktorSubDomain":
+    def from_login(
+        cls, sub_domain: str, username: str, password: str, workspace: str, max_workers: int = _MAX_WORKERS
+    ) -> "ViktorSubDomain":
         """Class method to login with sub-domain, username and password"""
         if not username or not password:
             print("Provide both username and password.")
             sys.exit(1)
 
         auth_details = {"client_id": CLIENT_ID, "username": username, "password": password, "grant_type": "password"}
-        return cls(sub_domain, auth_details, CLIENT_ID, workspace=workspace)
+        return cls(sub_domain, auth_details, CLIENT_ID, workspace=workspace, max_workers=max_workers)
 
     def get_workspaces_mapping(self) -> Dict[str, int]:
-        """Maps the workspace name (not case sensitive) to the workspace ID"""
-        workspaces_list = self._get_request(path="/workspaces/", exclude_workspace=True)
-        return {item["name"].lower(): int(item["id"]) for item in sorted(workspaces_list, key=lambda p: p["id"])}
+        """Maps the workspace name (not case sensitive) to the workspace ID
+
+        The mapping is retrieved once per user on a sub-domain and reused for all following lookups, also by other
+        logins of the same user (e.g. the source and destination of copy-entities).
+        """
+        key = (self.host, f"user:{self.username}" if self.username else f"token:{self.access_token}")
+        if key not in self._workspaces_mappings:
+            workspaces_list = self._get_request(path="/workspaces/", exclude_workspace=True)
+            self._workspaces_mappings[key] = {item["name"].lower(): int(item["id"]) for item in workspaces_list}
+        return self._workspaces_mappings[key]
 
     # ============================== Basic GET and POST requests ============================== #
-    def _get_request(self, path: str, exclude_workspace: bool = False) -> Union[dict, List[dict]]:
-        """Simple get request using the subdomain authentication"""
+    def _request(
+        self, method: str, path: str, data: dict = None, exclude_workspace: bool = False, timeout: int = 10
+    ) -> requests.Response:
+        """Sends a request to the sub-domain using the subdomain authentication, and raises if it was not successful.
+
+        If the tokens are expired, they are refreshed and the request is retried once.
+        Use exclude_workspace flag if the request should be send to an URL that does not include a workspace.
+        At most `max_workers` requests are sent concurrently, other threads wait until one of them is finished.
+        """
         if not path.startswith("/"):
             raise SyntaxError('URL should start with a "/"')
-        response = requests.request(
-            "GET", f"{self.host}{'' if exclude_workspace else self.workspace}{path}", headers=self.headers, timeout=10
-        )
+        url = f"{self.host}{'' if exclude_workspace else self.workspace}{path}"
+        access_token = self.access_token
+        with self._requests_semaphore:
+            response = self._session.request(method, url, json=data, headers=self.headers, timeout=timeout)
         if response.status_code == 401:
-            self.refresh_tokens()
-            response = requests.request(
-                "GET",
-                f"{self.host}{'' if exclude_workspace else self.workspace}{path}",
-                headers=self.headers,
-                timeout=10,
-            )
+            with self._refresh_lock:
+                # Refresh tokens are single use, so only refresh if no other thread did so while this request was sent
+                if self.access_token == access_token:
+                    self.refresh_tokens()
+            with self._requests_semaphore:
+                response = self._session.request(method, url, json=data, headers=self.headers, timeout=timeout)
         response.raise_for_status()
-        return response.json()
+        return response
+
+    def _get_request(self, path: str, exclude_workspace: bool = False) -> Union[dict, List[dict]]:
+        """Simple get request using the subdomain authentication"""
+        return self._request("GET", path, exclude_workspace=exclude_workspace).json()
 
     def _post_request(self, path: str, data: dict, exclude_workspace: bool = False) -> Union[dict, list, None]:
         """Simple post request using the subdomain authentication.
 
         Use exclude_workspace flag if the post request should be send to an URL that does not include a workspace.
         """
-        if not path.startswith("/"):
-            raise SyntaxError('URL should start with a "/"')
-        response = requests.request(
-            "POST",
-            f"{self.host}{'' if exclude_workspace else self.workspace}{path}",
-            data=json.dumps(data),
-            headers=self.headers,
-            timeout=10,
-        )
-        if response.status_code == 401:
-            self.refresh_tokens()
-            response = requests.request(
-                "POST",
-                f"{self.host}{'' if exclude_workspace else self.workspace}{path}",
-                data=json.dumps(data),
-                headers=self.headers,
-                timeout=10,
-            )
-        response.raise_for_status()
+        response = self._request("POST", path, data=data, exclude_workspace=exclude_workspace)
         if response.text:  # A DELETE request has no returned text, so check if there is text
             return response.json()
         return None
 
     def _put_request(self, path: str, data: dict) -> Union[dict, list]:
         """Simple put request using the subdomain authentication"""
-        if not path.startswith("/"):
-            raise SyntaxError('URL should start with a "/"')
-        response = requests.request(
-            "PUT", f"{self.host}{self.workspace}{path}", data=json.dumps(data), headers=self.headers, timeout=30
-        )
-        response.raise_for_status()
-        return response.json()
+        return self._request("PUT", path, data=data, timeout=30).json()
 
     def _delete_request(self, path: str) -> None:
         """Simple delete request"""
-        if not path.startswith("/"):
-            raise SyntaxError('URL should start with a "/"')
-        response = requests.request("DELETE", f"{self.host}{self.workspace}{path}", headers=self.headers, timeout=30)
-        response.raise_for_status()
+        self._request("DELETE", path, timeout=30)
 
     # ============================== All GET requests ============================== #
     def get_root_entities(self) -> List[EntityDict]:
@@ -316,8 +397,13 @@ class ViktorSubDomain:
         return self._get_request("/entities/")
 
     def get_entity_types(self) -> List[dict]:
-        """Replacement of the entity_types() method in the SDK"""
-        return self._get_request("/entity_types/")
+        """Replacement of the entity_types() method in the SDK
+
+        The entity types do not change during a session, so they are retrieved once and reused for all following calls.
+        """
+        if self._entity_types is None:
+            self._entity_types = self._get_request("/entity_types/")
+        return self._entity_types
 
     def get_all_entities_of_entity_type(self, entity_type: int) -> List[EntityDict]:
         """Replacement of the entity_type(id).entities() method in the SDK"""
@@ -334,11 +420,13 @@ class ViktorSubDomain:
         self._clean_up_entity(entity)
 
         # Save the parent entity type, which can be useful when posting the entity later on.
-        entity.update({"parent_entity_type": parents[0]["entity_type"] if parents else None, "size": 1, "children": []})
+        entity["parent_entity_type"] = parents[0]["entity_type"] if parents else None
+        entity["size"] = 1
+        entity["children"] = []
 
         if recursive:
-            entity.update({"children": self.get_children(entity["id"], recursive=recursive)})
-            entity.update({"size": _get_element_count_of_tree([entity], size=0)})
+            entity["children"] = self.get_children(entity["id"], recursive=recursive)
+            entity["size"] = _get_element_count_of_tree([entity], size=0)
 
         return entity
 
@@ -351,6 +439,9 @@ class ViktorSubDomain:
 
         In addition to the standard get children function, for each file entity the filename-property is replaced with
         the temporary_download_url from S3. This will allow the file to be downloaded, should it be needed later on.
+
+        If recursive, the tree is retrieved level by level, requesting the children of all entities of a level
+        concurrently.
         """
         children = self._get_request(f"/entities/{parent_id}/entities/")
 
@@ -362,45 +453,94 @@ class ViktorSubDomain:
             self._clean_up_entity(child)
 
         if recursive:
-            return [
-                {
-                    "id": child["id"],
-                    "entity_type": child["entity_type"],
-                    "name": child["name"],
-                    "properties": child["properties"],
-                    "children": self.get_children(child["id"], recursive=recursive),
-                }
-                for child in children
-            ]
+            tree = [_to_tree_node(child) for child in children]
+            level = tree
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while level:
+                    for node, node_children in zip(level, executor.map(self.get_children, [n["id"] for n in level])):
+                        node["children"] = [_to_tree_node(child) for child in node_children]
+                    level = [child for node in level for child in node["children"]]
+            return tree
 
         return children
 
-    def get_entity_tree(self, parent_id: int = None, exclude_children: bool = False) -> EntityDict:
+    def get_entity_tree(
+        self, parent_id: int = None, exclude_children: bool = False, verbose: bool = True
+    ) -> EntityDict:
         """Iterates through the entity database using a recursive function.
 
         Prompts the user for the top level entity to start with and then goes down the entity tree.
+        If verbose is False nothing is printed, e.g. when the tree is retrieved in the background.
         """
         parent_id = parent_id or int(input("Insert entity_id of desired entity: "))
-        parent_entity = self.get_entity(parent_id)
+        # The parent entity is retrieved once, its children are added to it below if they are included
+        entity_tree = self.get_entity(parent_id)
+        if verbose:
+            self._print_entity_tree_retrieval(entity_tree, exclude_children)
+        if not exclude_children:
+            entity_tree["children"] = self.get_children(parent_id, recursive=True)
+            entity_tree["size"] = _get_element_count_of_tree([entity_tree], size=0)
+        if verbose:
+            self._print_entity_tree_retrieved(exclude_children)
+        return entity_tree
+
+    def _print_entity_tree_retrieval(self, entity_tree: EntityDict, exclude_children: bool) -> None:
+        """Prints which entity tree is retrieved, with a note if its top level entity is a Root entity"""
         if exclude_children:
-            print(f'Retrieving {parent_entity["name"]}')
-            entity_tree = self.get_entity(parent_id, recursive=False)
-            print("Successfully obtained entity!\n")
+            print(f'Retrieving {entity_tree["name"]}')
+            return
+        if not entity_tree["parent_entity_type"]:
+            click.secho(
+                "Note: Current entity is a Root entity. "
+                "A Root entity cannot be created in the destination, only updated.\n"
+                "Consider using the `copy-revision` command to update the Root entity params:\n"
+                f"`dev-cli copy-revision -s {self.name} -sw {self.workspace_id} -si {entity_tree['id']} ...`",
+                fg="bright_yellow",
+            )
         else:
-            if not parent_entity["parent_entity_type"]:
-                click.secho(
-                    "Note: Current entity is a Root entity. "
-                    "A Root entity cannot be created in the destination, only updated.\n"
-                    "Consider using the `copy-revision` command to update the Root entity params:\n"
-                    f"`dev-cli copy-revision -s {self.name} -sw {self.workspace_id} -si {parent_id} ...`",
-                    fg="bright_yellow",
-                )
-            else:
-                print(f'Retrieving {parent_entity["name"]}.')
-            print(f'Recursively retrieving all entities under {parent_entity["name"]}.')
-            entity_tree = self.get_entity(parent_id, recursive=True)
-            print("Successfully obtained all entities!\n")
-        return entity_tree
+            print(f'Retrieving {entity_tree["name"]}.')
+        print(f'Recursively retrieving all entities under {entity_tree["name"]}.')
+
+    @staticmethod
+    def _print_entity_tree_retrieved(exclude_children: bool) -> None:
+        """Prints that the retrieval of an entity tree is finished"""
+        print("Successfully obtained entity!\n" if exclude_children else "Successfully obtained all entities!\n")
+
+    def iter_entity_trees(
+        self, parent_ids: Iterable[int], exclude_children: bool = False, max_prefetched: int = _MAX_PREFETCHED_TREES
+    ) -> Iterator[EntityDict]:
+        """Yields the entity tree of each parent id, while the next trees are already retrieved concurrently.
+
+        This allows posting a tree to the destination, while the trees after it are still being downloaded.
+        At most `max_prefetched` trees are retrieved ahead of the tree that is being consumed.
+        The trees are retrieved silently in the background, the status of each tree is printed when it is yielded, so
+        it does not interfere with the output or prompts of the consumer.
+        """
+
+        def report(retrieved_tree: Future) -> EntityDict:
+            entity_tree = retrieved_tree.result()
+            self._print_entity_tree_retrieval(entity_tree, exclude_children)
+            self._print_entity_tree_retrieved(exclude_children)
+            return entity_tree
+
+        with ThreadPoolExecutor(max_workers=max_prefetched) as executor:
+            retrieved_trees: Deque[Future] = deque()
+            try:
+                for parent_id in parent_ids:
+                    retrieved_trees.append(
+                        executor.submit(
+                            self.get_entity_tree, parent_id=parent_id, exclude_children=exclude_children, verbose=False
+                        )
+                    )
+                    if len(retrieved_trees) > max_prefetched:
+                        yield report(retrieved_trees.popleft())
+                while retrieved_trees:
+                    yield report(retrieved_trees.popleft())
+            finally:
+                # If the consumer stops early (e.g. on an abort), the trees that are not yet being retrieved are
+                # cancelled, so the executor only waits for the trees that are in progress
+                for retrieved_tree in retrieved_trees:
+                    retrieved_tree.cancel()
 
     def get_entity_type_mapping(self, destination: "ViktorSubDomain") -> Dict[int, int]:
         """Maps the id's of the entity types from source to destination, based on entity type name"""
@@ -424,11 +564,31 @@ class ViktorSubDomain:
         """Get the parametrization of the current entity. In this parametrization the field types can be found"""
         return self._post_request(f"/entities/{entity_id}/parametrization/", {})
 
+    def get_entity_type_id_updaters(self, entity_type: int, entity_id: int) -> Tuple[EntityIdUpdater, ...]:
+        """Get the functions that update the fields of the entity type that refer to some entity.
+
+        See get_field_names_referring_to_entities and compile_entity_id_updaters. The parametrization is identical for
+        all entities of a type, so it is requested, analysed and compiled once per type.
+        """
+        if entity_type not in self._entity_id_updaters:
+            with self._entity_id_updaters_lock:
+                # Another thread may have requested the parametrization of this type while waiting for the lock
+                if entity_type not in self._entity_id_updaters:
+                    parametrization = self.get_parametrization(entity_id)
+                    self._entity_id_updaters[entity_type] = (
+                        compile_entity_id_updaters(
+                            get_field_names_referring_to_entities(parametrization["content"]["parametrization"])
+                        )
+                        if parametrization
+                        else ()
+                    )
+        return self._entity_id_updaters[entity_type]
+
     def upload_file(self, file_content: bytes, entity_type: int) -> str:
         """Uploads a file to S3 using the host authentication and returns the filename url"""
         # Upload the file to S3
         result = self._post_request(f"/entity_types/{entity_type}/upload/", data={})
-        requests.post(result["url"], data=result["fields"], files={"file": file_content}, timeout=60)
+        self._session.post(result["url"], data=result["fields"], files={"file": file_content}, timeout=60)
 
         # Return the filename url which should be add the the file entity
         return result["fields"]["key"]
@@ -440,28 +600,22 @@ class ViktorSubDomain:
         entity_dict: dict,
         file_content: bytes = None,
         dry_run: bool = False,
-        old_to_new_ids_mapping: Optional[Dict] = None,
     ) -> EntityDict:
         """Replacement of the entity().post_child() method in the SDK
 
         Has additional option to include file_content, which creates the file entity and also
         uploads file_content to S3.
-
-        If an old_to_new_ids_mapping is given as dict, the dict is updated with a
-        mapping of the children {old_id: new_id}
         """
         if dry_run:
             return {"id": 0}
 
         if file_content:
             file_url = self.upload_file(file_content, entity_type)
-            entity_dict["properties"].update({"filename": file_url})
+            entity_dict["properties"]["filename"] = file_url
 
         data = {"entity_type": entity_type, "name": entity_dict["name"], "properties": entity_dict["properties"]}
         response = self._post_request(f"/entities/{parent_id}/entities/", data)
-        self._progressbar.update(1)
-        if old_to_new_ids_mapping is not None:
-            old_to_new_ids_mapping[entity_dict["id"]] = response["id"]
+        self._entities_of_type.pop(entity_type, None)
 
         return response
 
@@ -474,30 +628,43 @@ class ViktorSubDomain:
         recursive: bool = False,
         old_to_new_ids_mapping: Optional[Dict] = None,
     ) -> None:
-        """Creates the children under the top-level entity"""
-        for child in children:
-            try:
-                new_entity_type_id = entity_type_mapping[child["entity_type"]]
-                created_child = self.post_child(
-                    parent_id,
-                    new_entity_type_id,
-                    child,
-                    file_content=get_file_content_from_s3(child),
-                    dry_run=dry_run,
-                    old_to_new_ids_mapping=old_to_new_ids_mapping,
-                )
+        """Creates the children under the top-level entity
 
-                if recursive:
-                    self.post_children(
-                        created_child["id"],
-                        child["children"],
-                        entity_type_mapping,
-                        dry_run=dry_run,
-                        recursive=recursive,
-                        old_to_new_ids_mapping=old_to_new_ids_mapping,
-                    )
-            except KeyError:
-                print(f'Could not find entity type for {child["name"]}. Skipping entity and all its children.')
+        The entities are created level by level. All entities of a level are posted concurrently, since they only depend
+        on their parents, which are created in the level before.
+        """
+
+        def post_entity(parent_id_and_child: Tuple[int, dict]) -> EntityDict:
+            new_parent_id, child = parent_id_and_child
+            # The file is only downloaded right before it is uploaded, so at most one file per worker is held in memory
+            file_content = None if dry_run else get_file_content_from_s3(child, self._session)
+            return self.post_child(
+                new_parent_id,
+                entity_type_mapping[child["entity_type"]],
+                child,
+                file_content=file_content,
+                dry_run=dry_run,
+            )
+
+        level = [(parent_id, child) for child in children]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while level:
+                postable_level = []
+                for new_parent_id, child in level:
+                    if child["entity_type"] in entity_type_mapping:
+                        postable_level.append((new_parent_id, child))
+                    else:
+                        print(f'Could not find entity type for {child["name"]}. Skipping entity and all its children.')
+
+                level = []
+                for (_, child), created_child in zip(postable_level, executor.map(post_entity, postable_level)):
+                    # Shared state is only updated from this thread, the workers only do the requests
+                    if self._progressbar is not None:
+                        self._progressbar.update(1)
+                    if old_to_new_ids_mapping is not None and not dry_run:
+                        old_to_new_ids_mapping[child["id"]] = created_child["id"]
+                    if recursive:
+                        level.extend((created_child["id"], grandchild) for grandchild in child["children"])
 
     def post_entity_tree(
         self,
@@ -507,9 +674,9 @@ class ViktorSubDomain:
         dry_run: bool = False,
         old_to_new_ids_mapping: Optional[Dict] = None,
     ) -> None:
-        """Iterates through the entity tree using a recursive function. Prompts the user for the top level entity.
+        """Iterates through the entity tree level by level. Prompts the user for the top level entity.
 
-        If dry_run is set to True, the recursive functions doesn't post to destination, but prints to screen
+        If dry_run is set to True, the entities are not posted to destination
         """
         is_root = entity_tree["parent_entity_type"] is None
         if is_root:  # Parent entity will be the Root entity itself. Will only post the children entity types
@@ -534,6 +701,7 @@ class ViktorSubDomain:
                 recursive=True,
                 old_to_new_ids_mapping=old_to_new_ids_mapping,
             )
+        self._progressbar = None
 
     def update_entity(
         self, entity_id: int, entity_properties: EntityDict, dry_run: bool = False, message: str = None
@@ -555,49 +723,64 @@ class ViktorSubDomain:
         as collection of json files
         """
         destination_dir = Path(f"{destination}")
-        if not destination_dir.exists():
-            destination_dir.mkdir()
 
-        for entity_type in self.get_entity_types():
-            if entity_type["class_name"] in entity_type_names:
+        entity_types = [et for et in self.get_entity_types() if et["class_name"] in entity_type_names]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # The entities of all types are requested up front, while the entities of the first type are written
+            entities_per_type = [
+                executor.submit(self.get_all_entities_of_entity_type, entity_type["id"]) for entity_type in entity_types
+            ]
+            for entity_type, entities_of_type in zip(entity_types, entities_per_type):
                 entity_type_dir = destination_dir / entity_type["class_name"]
-                if not entity_type_dir.exists():
-                    entity_type_dir.mkdir()
+                entity_type_dir.mkdir(parents=True, exist_ok=True)
 
                 print(
                     f'Getting all entities of type {entity_type["class_name"]} '
                     f"(can take a while if there are many entities)"
                 )
-                entities_of_specificed_type = self.get_all_entities_of_entity_type(entity_type["id"])
+                entities_of_specificed_type = entities_of_type.result()
+                if include_revisions:
+                    # The revisions of all entities are requested concurrently, and written in order as they come in
+                    revisions_per_entity = executor.map(
+                        self.get_entity_revisions, [entity["id"] for entity in entities_of_specificed_type]
+                    )
                 with click.progressbar(
                     entities_of_specificed_type, label=f'Writing all entities of type {entity_type["class_name"]}'
                 ) as progressbar:
                     for entity in progressbar:
                         if include_revisions:
-                            for i, rev in enumerate(self.get_entity_revisions(entity["id"])):
+                            for i, rev in enumerate(next(revisions_per_entity)):
                                 with (entity_type_dir / f'{entity["id"]}_rev{i}.json').open(mode="w+") as entity_file:
-                                    json.dump(rev, entity_file)
+                                    entity_file.write(json.dumps(rev))
                         else:
                             with (entity_type_dir / f'{entity["id"]}.json').open(mode="w+") as entity_file:
-                                json.dump(entity, entity_file)
+                                entity_file.write(json.dumps(entity))
                 print("All entities succesfully saved")
 
     def download_database_to_local_folder(self, destination: str, filename: str):
-        """Transfers all entities from current sub-domain to destination location as a single json file"""
-        database_dict = {}  # Set up a dict which will be written to a file in the end
-        all_entities = []  # Make a list in which all root entities including children will be saved
-        for root_entity in self.get_root_entities():
-            all_entities.append(self.get_entity_tree(root_entity["id"]))  # Append all root entities and children
-
-        database_dict["entities"] = all_entities
-        database_dict["entity_types"] = self.get_entity_types()
+        """Transfers all entities from current sub-domain to destination location as a single json file
 
-        # Save this as a json
+        The entity tree of each root entity is written as soon as it is retrieved, so at most two trees are held in
+        memory (the tree that is written and the next tree that is retrieved meanwhile).
+        The file is written next to the destination first, so an interrupted stash does not overwrite a previous one.
+        """
         destination_dir = Path(f"{destination}")
         destination_dir.mkdir(parents=True, exist_ok=True)
         destination_path = destination_dir / filename
-        with open(destination_path, "w") as dest_file:
-            json.dump(database_dict, dest_file)
+        partial_path = destination_path.with_name(f"{filename}.partial")
+
+        root_entity_ids = [root_entity["id"] for root_entity in self.get_root_entities()]
+        with open(partial_path, "w") as dest_file:
+            dest_file.write('{"entities": [')
+            for index, entity_tree in enumerate(self.iter_entity_trees(root_entity_ids, max_prefetched=1)):
+                if index:
+                    dest_file.write(", ")
+                # json.dumps encodes in one go with the C encoder, json.dump would go through the pure-Python encoder
+                dest_file.write(json.dumps(entity_tree))
+            dest_file.write('], "entity_types": ')
+            dest_file.write(json.dumps(self.get_entity_types()))
+            dest_file.write("}")
+        partial_path.replace(destination_path)
         print(f"Stashed database in {destination_path}")
 
     def upload_database_from_local_folder(self, source_folder: str, filename: str):
@@ -606,7 +789,7 @@ class ViktorSubDomain:
             database_dict = json.load(db_file)  # Get the database file
         entity_types = self.get_entity_types()
         destination_root_entities = self.get_root_entities()
-        validate_root_entities_compatibility(database_dict["entities"], destination_root_entities)
+        matched_root_entities = match_root_entities(database_dict["entities"], destination_root_entities)
 
         print("Successfully validated database compatibility. Removing children...")
         click.confirm(
@@ -622,14 +805,12 @@ class ViktorSubDomain:
 
         print("Uploading database...")
         old_to_new_ids_mapping = {}
-        for source_root_entity, destination_root_entity in zip(database_dict["entities"], destination_root_entities):
+        for source_root_entity, destination_root_entity in matched_root_entities:
             # Let's first set the revisions
             self.update_entity(
                 destination_root_entity["id"], source_root_entity["properties"], message="Apply database stash"
             )
-            old_to_new_ids_mapping.update(
-                {source_root_entity["id"]: destination_root_entity["id"]}
-            )  # Update the entity map
+            old_to_new_ids_mapping[source_root_entity["id"]] = destination_root_entity["id"]  # Update the entity map
             # Then let's upload the children
             self.post_entity_tree(
                 source_root_entity,
@@ -638,27 +819,33 @@ class ViktorSubDomain:
                 old_to_new_ids_mapping=old_to_new_ids_mapping,
             )
 
-        print("Replacing entity IDs...")
-        parametrization_dict = {}  # Make a dict to store entity_type and its field names that refer to entity types
-        for entity_id in old_to_new_ids_mapping.values():  # For every entity that is uploaded to the database
-            entity = self.get_entity(entity_id)  # Get the entity
-            if entity["entity_type"] not in parametrization_dict:  # Parametrization is not yet analysed for this type
-                parametrization = self.get_parametrization(entity_id)
-                field_names_list_container = []  # Set up the ID fields list
-                if parametrization:
-                    add_field_names_referring_to_entities_to_container(
-                        parametrization["content"]["parametrization"], field_names_list_container
-                    )
-                parametrization_dict.update({entity["entity_type"]: field_names_list_container})
-            if field_names_list_container := parametrization_dict[entity["entity_type"]]:
+        def replace_entity_ids(entity: EntityDict) -> None:
+            # The entity is updated from the properties it was uploaded with, so it does not have to be requested again.
+            # Its filename is already the key of the uploaded file, not a temporary download url
+            entity_id = old_to_new_ids_mapping[entity["id"]]
+            entity_type = entity_type_mapping[entity["entity_type"]]
+            if entity_id_updaters := self.get_entity_type_id_updaters(entity_type, entity_id):
                 properties = entity["properties"]
-                for field_names_list in field_names_list_container:
-                    update_id_on_entity_fields(
-                        field_names_list=field_names_list,
-                        properties=properties,
-                        old_to_new_ids_mapping=old_to_new_ids_mapping,
-                    )
-                self.update_entity(entity_id, properties)
+                changed = False
+                for update_ids in entity_id_updaters:
+                    changed |= update_ids(properties, old_to_new_ids_mapping)
+                if changed:  # Only create a new revision if some entity ID was actually replaced
+                    self.update_entity(entity_id, properties)
+
+        # Every entity that is uploaded to the database, entities that were skipped are not in the mapping
+        uploaded_entities = []
+        entities = [source_root_entity for source_root_entity, _ in matched_root_entities]
+        while entities:
+            entity = entities.pop()
+            if entity["id"] in old_to_new_ids_mapping:
+                uploaded_entities.append(entity)
+                entities.extend(entity["children"])
+
+        print("Replacing entity IDs...")
+        # The entities are independent of each other, so they are updated concurrently. Consuming the results re-raises
+        # the first error of any of the entities.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(replace_entity_ids, uploaded_entities))
         print("Successfully applied stashed database!")
 
     def add_user(self, user: ViktorUserDict):
@@ -683,18 +870,22 @@ class ViktorSubDomain:
 
         If only one entity id can be found, this one is selected by default.
         """
-        possible_parent_entities = self.get_all_entities_of_entity_type(parent_entity_type)
+        # Copying multiple entity trees asks for the same parent entity type each time, so the entities are kept until
+        # entities are posted to or deleted from this sub-domain
+        if parent_entity_type not in self._entities_of_type:
+            self._entities_of_type[parent_entity_type] = self.get_all_entities_of_entity_type(parent_entity_type)
+        possible_parent_entities = self._entities_of_type[parent_entity_type]
         default_id = possible_parent_entities[0]["id"]
         if len(possible_parent_entities) == 1:
             return default_id
 
         print("Destination parent entities: \n" + _repr_entities(possible_parent_entities) + "\n")
-        destination = int(click.prompt("Under which parent id should the entities be copied", default=default_id))
-
-        possible_parent_entity_ids = [entity["id"] for entity in possible_parent_entities]
-        while destination not in possible_parent_entity_ids:
-            destination = int(click.prompt("Entity id not possible, please try again", default=default_id))
-        return destination
+        # Click prompts again until one of the possible entity ids is given
+        return click.prompt(
+            "Under which parent id should the entities be copied",
+            default=default_id,
+            type=EntityIdChoice(entity["id"] for entity in possible_parent_entities),
+        )
 
     def _update_file_download(self, entity: EntityDict):
         """If entity is file entity, converts the filename to a temporary download url"""
@@ -710,6 +901,7 @@ class ViktorSubDomain:
     def delete_entity(self, entity_id: int) -> None:
         """Deletes an entity"""
         self._delete_request(f"/entities/{entity_id}/")
+        self._entities_of_type.clear()  # The entity type of the deleted entity and its children is not known here
 
     def delete_children(self, entity_id: Union[int, Dict]):
         """Deletes all entities below some entity_id.
@@ -718,7 +910,13 @@ class ViktorSubDomain:
         parent = entity_id
         if not isinstance(entity_id, dict):
             parent = self.get_entity_tree(entity_id)
-        child: dict
-        for child in parent["children"]:
-            self.delete_children(child)
-            self.delete_entity(child["id"])
+        levels = []
+        level = parent["children"]
+        while level:
+            levels.append(level)
+            level = [child for entity in level for child in entity["children"]]
+
+        # The tree is deleted level by level from the bottom up, so every entity is deleted after its children
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for level in reversed(levels):
+                list(executor.map(self.delete_entity, [entity["id"] for entity in level]))